@@ -38,6 +38,15 @@ batch_size = 128
 τ_cr = lambda t: 0.1 / 2**(t / 20000)
 τ_ds = lambda t: 1 / 2**(t / 20000)
 
+n_iter_ft = 20000
+t_ft = 40000
+
+n_paths = 2
+
+plateau_tol = 1e-3
+plateau_patience = 3
+t_fast_forward = 10000
+
 ################################################################################
 # Network Components
 ################################################################################
@@ -137,3 +146,21 @@ def cr_chain(**hypers):
 
 def cr_tree(**hypers):
     return dr_tree(CriticNet, **hypers)
+
+################################################################################
+# Benchmarked Network Types
+################################################################################
+
+net_types = {
+    'sr-chain': (
+        lambda **hypers: sr_chain(len(arch)), lambda net, t: {}),
+    'ac-chain': (ac_chain, lambda net, t: {net.τ: τ_ds(t)}),
+    'ac-tree': (ac_tree, lambda net, t: {net.τ: τ_ds(t)}),
+    'cr-chain': (cr_chain, lambda net, t: {net.τ: τ_cr(t)}),
+    'cr-tree': (cr_tree, lambda net, t: {net.τ: τ_cr(t)}),
+    'ac-tree-sampled': (
+        lambda **hypers: ac_tree(**{'n_paths': n_paths, **hypers}),
+        lambda net, t: {net.τ: τ_ds(t)}),
+    'cr-tree-sampled': (
+        lambda **hypers: cr_tree(**{'n_paths': n_paths, **hypers}),
+        lambda net, t: {net.τ: τ_cr(t)})}
@@ -1,3 +1,5 @@
+from os.path import dirname, join
+
 import numpy as np
 import numpy.random as rand
 
@@ -35,8 +37,8 @@ def augmented_batch(x0, y, n, m_sym, r_shift):
 
 def batch(x0, y, n):
     i = rand.randint(0, len(x0), n)
-    x0_batch = np.take(x0, i, axis=0)
-    y_batch = np.take(y, i, axis=0)
+    x0_batch = x0[i]
+    y_batch = y[i]
     return x0_batch, y_batch
 
 def full_set(x0, y, n):
@@ -46,6 +48,25 @@ def full_set(x0, y, n):
         yield x0[s], y[s]
         i += n
 
+################################################################################
+# Image Views
+################################################################################
+
+class ImageView:
+    def __init__(self, images, i):
+        self.images = images
+        self.i = i
+
+    def __len__(self):
+        return len(self.i)
+
+    def __getitem__(self, key):
+        return np.asarray(self.images[self.i[key]])
+
+    @property
+    def shape(self):
+        return (len(self.i),) + self.images.shape[1:]
+
 ################################################################################
 # Dataset
 ################################################################################
@@ -53,8 +74,14 @@ def full_set(x0, y, n):
 class Dataset:
     def __init__(self, path):
         archive = np.load(path)['arr_0'][()]
-        self.x0_tr = archive['x0_tr']
-        self.x0_ts = archive['x0_ts']
+        if 'images' in archive:
+            images = np.load(
+                join(dirname(path), archive['images']), mmap_mode='r')
+            self.x0_tr = ImageView(images, archive['i_tr'])
+            self.x0_ts = ImageView(images, archive['i_ts'])
+        else:
+            self.x0_tr = archive['x0_tr']
+            self.x0_ts = archive['x0_ts']
         self.y_tr = archive['y_tr']
         self.y_ts = archive['y_ts']
         self.m_sym = archive['m_sym']
@@ -1,39 +1,116 @@
 import numpy as np
 import tensorflow as tf
 
-__all__ = ['net_desc', 'render_net_desc']
+from lib.tuning import net_type_key, read_profile
+
+__all__ = ['net_desc', 'net_trace', 'critic_trace', 'render_net_desc']
 
 ################################################################################
 # Descriptors
 ################################################################################
 
-def mean_net_state(net, tensors, data, hypers):
-    if len(tensors) == 0:
-        return {}
+def mean_net_state(net, tensors, data, hypers, per_sample={}):
+    if len(tensors) == 0 and len(per_sample) == 0:
+        return {}, {}
     else:
         sums = {k: 0 for k in tensors.keys()}
+        chunks = {k: [] for k in per_sample.keys()}
         count = 0
         for x0, y in data:
             samples = tf.get_default_session().run(
-                tensors, {net.x0: x0, net.y: y, **hypers})
+                {**tensors, **per_sample}, {net.x0: x0, net.y: y, **hypers})
             for k in tensors.keys():
                 sums[k] += np.sum(samples[k], 0)
+            for k in per_sample.keys():
+                chunks[k].append(samples[k])
             count += len(x0)
-        return {k: (sums[k] / count).tolist() for k in tensors.keys()}
+        return {k: (sums[k] / count).tolist() for k in tensors.keys()}, chunks
 
 def layer_desc(ℓ, stats_tr, stats_ts):
     return {'name': ℓ.name,
+            'n_mem_path': ℓ.n_mem_path,
             'stats_tr': {k: v for (t, k), v in stats_tr.items() if t == ℓ},
             'stats_ts': {k: v for (t, k), v in stats_ts.items() if t == ℓ},
             'sinks': [layer_desc(s, stats_tr, stats_ts) for s in ℓ.sinks]}
 
-def net_desc(net, dataset, hypers={}, state={}):
-    stats_tr = mean_net_state(net, state, dataset.training_set(), hypers)
-    stats_ts = mean_net_state(net, state, dataset.test_set(), hypers)
-    return {'type': type(net).__name__,
+def net_desc(net, dataset, hypers={}, state={}, batch_size=None, trace=False,
+             state_tr={}):
+    n = batch_size or read_profile(net_type_key(net))['batch_size_ev']
+    state = {(net, 'mpm'): sum(ℓ.p_ev * ℓ.n_mem_path for ℓ in net.leaves),
+             **state}
+    stats_tr, _ = mean_net_state(
+        net, {**state, **state_tr}, dataset.training_set(n), hypers)
+    stats_ts, chunks = mean_net_state(
+        net, state, dataset.test_set(n), hypers,
+        trace_tensors(net) if trace else {})
+    desc = {'type': type(net).__name__,
             'stats_tr': {k: v for (t, k), v in stats_tr.items() if t == net},
             'stats_ts': {k: v for (t, k), v in stats_ts.items() if t == net},
             'root': layer_desc(net.root, stats_tr, stats_ts)}
+    return (desc, collect_trace(net, dataset, chunks)) if trace else desc
+
+################################################################################
+# Routing Traces
+################################################################################
+
+def trace_tensors(net):
+    tot_n_ops = lambda ℓ: ℓ.n_ops + getattr(ℓ.router, 'n_ops', 0)
+    return {'p_ev': [ℓ.p_ev for ℓ in net.leaves],
+            'δ_cor': [ℓ.δ_cor for ℓ in net.leaves],
+            'n_ops': sum(ℓ.p_ev * tot_n_ops(ℓ) for ℓ in net.layers),
+            'cls': tf.argmax(net.y, 1)}
+
+def collect_trace(net, dataset, chunks):
+    leaves = list(net.leaves)
+    leaf = [np.argmax(np.transpose(p_ev), 1) for p_ev in chunks['p_ev']]
+    cor = [np.transpose(δ_cor)[np.arange(len(i)), i] > 0.5
+           for δ_cor, i in zip(chunks['δ_cor'], leaf)]
+    n_ops = [n * np.ones(len(i)) for n, i in zip(chunks['n_ops'], leaf)]
+    n_leaves = len(leaves)
+    n_cls = dataset.y_shape[0]
+    return {'leaf': np.concatenate(leaf).astype(
+                np.min_scalar_type(n_leaves - 1)),
+            'cor': np.concatenate(cor),
+            'n_ops': np.float32(np.concatenate(n_ops)),
+            'cls': np.concatenate(chunks['cls']).astype(
+                np.min_scalar_type(n_cls - 1)),
+            'n_mem_path': np.float32([ℓ.n_mem_path for ℓ in leaves]),
+            'n_leaves': n_leaves,
+            'n_cls': n_cls}
+
+def net_trace(net, dataset, hypers={}, batch_size=None):
+    n = batch_size or read_profile(net_type_key(net))['batch_size_ev']
+    _, chunks = mean_net_state(
+        net, {}, dataset.test_set(n), hypers, trace_tensors(net))
+    return collect_trace(net, dataset, chunks)
+
+def critic_trace(net, dataset, hypers={}, batch_size=None):
+    layers = list(net.layers)
+    index = {id(ℓ): j for j, ℓ in enumerate(layers)}
+    switches = [j for j, ℓ in enumerate(layers) if len(ℓ.sinks) > 1]
+    leaves = [ℓ for ℓ in layers if len(ℓ.sinks) == 0]
+    tot_n_ops = lambda ℓ: ℓ.n_ops + getattr(ℓ.router, 'n_ops', 0)
+    tensors = {
+        'x_rte': [layers[j].router.x for j in switches],
+        'δ_cor': [ℓ.δ_cor for ℓ in leaves]}
+    chunks = {'x_rte': [], 'δ_cor': []}
+    n = batch_size or read_profile(net_type_key(net))['batch_size_ev']
+    for x0, y in dataset.test_set(n):
+        samples = tf.get_default_session().run(
+            tensors, {net.x0: x0, net.y: y, **hypers})
+        chunks['x_rte'].append(samples['x_rte'])
+        chunks['δ_cor'].append(np.transpose(samples['δ_cor']) > 0.5)
+    parent = np.full(len(layers), -1)
+    for j, ℓ in enumerate(layers):
+        for s in ℓ.sinks:
+            parent[index[id(s)]] = j
+    return {'parent': parent,
+            'n_ops': np.float64(tf.get_default_session().run(
+                [tf.to_float(tot_n_ops(ℓ)) for ℓ in layers])),
+            'n_mem_path': np.float64([ℓ.n_mem_path for ℓ in layers]),
+            'δ_cor': np.concatenate(chunks['δ_cor']),
+            **{'x_rte_%i' % j: np.concatenate([c[i] for c in chunks['x_rte']])
+               for i, j in enumerate(switches)}}
 
 ################################################################################
 # Descriptor Rendering
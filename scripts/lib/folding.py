@@ -0,0 +1,95 @@
+import numpy as np
+
+__all__ = ['fold_net_record']
+
+################################################################################
+# Support Functions
+################################################################################
+
+def bn_affine(record):
+    θ, ϕ = record['params'], record['hypers']
+    a = θ['γ'] / np.sqrt(θ['v_avg'] + ϕ['ϵ'])
+    return a, θ['β'] - a * θ['m_avg']
+
+def const_conv(u, w, h, w_):
+    # The "SAME" convolution of a spatially-constant image `u` with `w`.
+    uw = np.einsum('c,ijco->ijo', u, w)
+    pad_u = (w.shape[0] - 1) // 2
+    pad_v = (w.shape[1] - 1) // 2
+    p = np.arange(h)[:, None] + np.arange(w.shape[0]) - pad_u
+    q = np.arange(w_)[:, None] + np.arange(w.shape[1]) - pad_v
+    valid_u = np.float64((p >= 0) & (p < h))
+    valid_v = np.float64((q >= 0) & (q < w_))
+    return np.einsum('pi,qj,ijo->pqo', valid_u, valid_v, uw)
+
+################################################################################
+# Layer Folding
+################################################################################
+
+def fold_lin_trans(record, bn_record):
+    a, c = bn_affine(bn_record)
+    θ = record['params']
+    return {**record,
+            'hypers': {**record['hypers'], 'k_l2': 0, 'res': False},
+            'params': {'w': np.float32(θ['w'] * a),
+                       'b': np.float32(θ['b'] * a + c)}}
+
+def can_fold_conv_max(bn_record):
+    return all(
+        np.all(bn_affine(r)[0] > 0)
+        for r in bn_record['comps'][:-1])
+
+def fold_conv_max(layer, record, bn_record):
+    # `MultiscaleConvMax` feeds the unnormalized output of each scale to the
+    # next, so each vertical kernel undoes the previous scale's normalization.
+    # With zero padding, the resulting offset varies near image borders, so
+    # the folded biases are per-pixel maps.
+    θ = record['params']
+    n = len(record['hypers']['n_chan'])
+    a, c = zip(*map(bn_affine, bn_record['comps']))
+    params = {}
+    for k in range(n):
+        h, w_ = layer.x[k].get_shape().as_list()[1:3]
+        params['w_horz_%i' % k] = θ['w_horz_%i' % k] * a[k]
+        b_k = θ['b_%i' % k] * np.ones((h, w_, 1))
+        if k > 0:
+            w_vert = θ['w_vert_%i' % (k - 1)] / a[k-1][:, None]
+            params['w_vert_%i' % (k - 1)] = w_vert * a[k]
+            b_k = b_k - const_conv(c[k-1], w_vert, h, w_)
+        params['b_%i' % k] = a[k] * b_k + c[k]
+    return {**record, 'type': 'FoldedMultiscaleConvMax',
+            'hypers': {'n_chan': record['hypers']['n_chan'],
+                       'supp': record['hypers']['supp']},
+            'params': {k: np.float32(v) for k, v in params.items()}}
+
+def fold_comps(layers, records):
+    folded = []
+    j = 0
+    while j < len(records):
+        r = records[j]
+        r_next = records[j+1] if j + 1 < len(records) else {'type': None}
+        if r['type'] == 'LinTrans' and r_next['type'] == 'BatchNorm':
+            folded.append(fold_lin_trans(r, r_next))
+            j += 2
+        elif (r['type'] == 'MultiscaleConvMax'
+              and r_next['type'] == 'MultiscaleBatchNorm'
+              and can_fold_conv_max(r_next)):
+            folded.append(fold_conv_max(layers[j], r, r_next))
+            j += 2
+        else:
+            folded.append(fold_layer(layers[j], r))
+            j += 1
+    return folded
+
+def fold_layer(layer, record):
+    return None if record is None else {
+        **record,
+        'comps': fold_comps(layer.comps, record['comps']),
+        'sinks': [fold_layer(ℓ, r)
+                  for ℓ, r in zip(layer.sinks, record['sinks'])],
+        'router': fold_layer(layer.router, record['router'])}
+
+def fold_net_record(net, record):
+    return {**record,
+            'hypers': {**record['hypers'], 'inference': True},
+            'root': fold_layer(net.root, record['root'])}
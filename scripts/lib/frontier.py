@@ -0,0 +1,96 @@
+import numpy as np
+
+__all__ = ['greedy_stats', 'critic_frontier']
+
+################################################################################
+# Support Functions
+################################################################################
+
+def tree_sinks(parent):
+    sinks = [[] for _ in parent]
+    for j, p in enumerate(parent):
+        if p >= 0:
+            sinks[p].append(j)
+    return sinks
+
+def path_stats(trace, ops, leaf):
+    parent = trace['parent']
+    is_leaf = np.bincount(parent[1:], minlength=len(parent)) == 0
+    col = np.cumsum(is_leaf) - 1
+    n_pts = len(trace['δ_cor'])
+    cor = trace['δ_cor'][np.arange(n_pts), col[leaf]]
+    return np.mean(cor, -1), np.mean(ops, -1)
+
+################################################################################
+# Offline Routing
+################################################################################
+
+def route_greedy(trace, sinks, errs, j=0):
+    # Follows the routing decisions made by the network, and records the error
+    # cost that each router predicts for each of its sinks. Critic routers
+    # predict the negative total cost of each sink, including the computation
+    # and memory costs of the greedy path below it; subtracting these leaves
+    # the predicted error cost, which does not depend on k_cpt.
+    n_pts = len(trace['δ_cor'])
+    if len(sinks[j]) == 0:
+        return np.full(n_pts, trace['n_ops'][j]), np.full(n_pts, j)
+    paths = [route_greedy(trace, sinks, errs, s) for s in sinks[j]]
+    if len(paths) == 1:
+        ops, leaf = paths[0]
+    else:
+        x = trace['x_rte_%i' % j]
+        errs[j] = -x - np.stack([
+            trace['k_cpt'] * ops + trace['k_mem'] * trace['n_mem_path'][leaf]
+            for ops, leaf in paths], -1)
+        i = np.argmax(x, -1)
+        ops = np.choose(i, [p[0] for p in paths])
+        leaf = np.choose(i, [p[1] for p in paths])
+    return trace['n_ops'][j] + ops, leaf
+
+def route(trace, sinks, errs, k_cpt, j=0):
+    # Chooses the sink with the lowest predicted cost for each value of k_cpt.
+    # `δ_err` is the predicted change in error cost relative to the greedy
+    # path, caused by decisions that differ from the network's.
+    shape = (len(k_cpt), len(trace['δ_cor']))
+    if len(sinks[j]) == 0:
+        return (np.full(shape, trace['n_ops'][j]), np.full(shape, j),
+                np.zeros(shape))
+    paths = [route(trace, sinks, errs, k_cpt, s) for s in sinks[j]]
+    if len(paths) == 1:
+        ops, leaf, δ_err = paths[0]
+    else:
+        err = [errs[j][:, i] + p[2] for i, p in enumerate(paths)]
+        c_tot = np.stack([
+            e + k_cpt * ops + trace['k_mem'] * trace['n_mem_path'][leaf]
+            for e, (ops, leaf, _) in zip(err, paths)], -1)
+        i = np.argmin(c_tot, -1)
+        i_greedy = np.argmax(trace['x_rte_%i' % j], -1)
+        ops = np.choose(i, [p[0] for p in paths])
+        leaf = np.choose(i, [p[1] for p in paths])
+        δ_err = (
+            np.choose(i, err)
+            - errs[j][np.arange(shape[1]), i_greedy])
+    return trace['n_ops'][j] + ops, leaf, δ_err
+
+################################################################################
+# Accuracy/Efficiency Frontiers
+################################################################################
+
+def greedy_stats(trace):
+    sinks = tree_sinks(trace['parent'])
+    return path_stats(trace, *route_greedy(trace, sinks, {}))
+
+def critic_frontier(trace, k_cpts, chunk_size=16):
+    sinks = tree_sinks(trace['parent'])
+    errs = {}
+    route_greedy(trace, sinks, errs)
+    acc, moc = [], []
+    for i in range(0, len(k_cpts), chunk_size):
+        k_cpt = np.reshape(k_cpts[i:i+chunk_size], (-1, 1))
+        ops, leaf, _ = route(trace, sinks, errs, k_cpt)
+        acc_i, moc_i = path_stats(trace, ops, leaf)
+        acc.append(acc_i)
+        moc.append(moc_i)
+    return {'k_cpt': np.float64(k_cpts),
+            'acc': np.concatenate(acc),
+            'moc': np.concatenate(moc)}
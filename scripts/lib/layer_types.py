@@ -4,6 +4,20 @@ from types import SimpleNamespace as Ns
 import numpy as np
 import tensorflow as tf
 
+################################################################################
+# Support Functions
+################################################################################
+
+def n_act(x):
+    if isinstance(x, list):
+        return sum(map(n_act, x))
+    dims = x.get_shape().as_list()[1:]
+    if None in dims:
+        raise ValueError(
+            'cannot count the activations of a tensor with shape %s'
+            % x.get_shape())
+    return int(np.prod(dims))
+
 ################################################################################
 # Core Layer Class
 ################################################################################
@@ -18,12 +32,18 @@ class Layer(metaclass=ABCMeta):
         self.comps = options.pop('comps', [])
         self.hypers = Ns(**{**vars(type(self).default_hypers), **options})
         self.params = Ns()
+        self.inference = False
 
     def link(self, x, y, mode):
         self.x = x
         self.c_err = tf.zeros(())
         self.c_mod = tf.zeros(())
         self.n_ops = tf.zeros(())
+        self.n_in = n_act(x)
+
+    @property
+    def n_mem(self):
+        return self.n_in + n_act(self.x)
 
 ################################################################################
 # The No-Op Layer
@@ -49,7 +69,8 @@ class LinTrans(Layer):
         θ.w = tf.Variable(w_eq + w_scale * tf.random_normal(w_shape))
         θ.b = tf.Variable(tf.zeros(ϕ.n_chan))
         self.x = tf.matmul(tf.reshape(x, (-1, n_in)), θ.w) + θ.b
-        self.c_mod = ϕ.k_l2 * tf.reduce_sum(tf.square(θ.w - w_eq))
+        if not self.inference:
+            self.c_mod = ϕ.k_l2 * tf.reduce_sum(tf.square(θ.w - w_eq))
         self.n_ops = n_in * ϕ.n_chan
 
 class Conv(Layer):
@@ -70,7 +91,8 @@ class Conv(Layer):
         θ.w = tf.Variable(w_eq + w_scale * tf.random_normal(w_shape))
         θ.b = tf.Variable(tf.zeros(ϕ.n_chan))
         self.x = tf.nn.conv2d(x, θ.w, (1, 1, 1, 1), 'SAME') + θ.b
-        self.c_mod = ϕ.k_l2 * tf.reduce_sum(tf.square(θ.w - w_eq))
+        if not self.inference:
+            self.c_mod = ϕ.k_l2 * tf.reduce_sum(tf.square(θ.w - w_eq))
         self.n_ops = n_pix * ϕ.supp**2 * n_in * ϕ.n_chan
 
 class Rect(Layer):
@@ -115,6 +137,23 @@ def n_pix(x):
 def n_el(x):
     return int(np.prod(x.get_shape().as_list()))
 
+def conv_max(x, w_horz, w_vert, b):
+    y = len(b) * [None]
+    y[0] = b[0] + conv(x[-len(b)], w_horz[0])
+    for i in range(1 - len(b), 0):
+        y[i] = (
+            b[i] + conv(x[i], w_horz[i])
+            + conv(pool(y[i-1]), w_vert[i]))
+    return y
+
+def conv_max_n_ops(y, w_horz, w_vert):
+    return sum(
+        n_pix(y_i) * (
+            n_el(w_horz[i])
+            + (n_el(w_vert[i-1])
+               if i > 0 else 0))
+        for i, y_i in enumerate(y))
+
 class ToPyramid(Layer):
     default_hypers = Ns(n_scales=1)
 
@@ -177,21 +216,42 @@ class MultiscaleConvMax(Layer):
             setattr(θ, 'w_vert_%i' % i, w_i)
         for i, b_i in enumerate(b):
             setattr(θ, 'b_%i' % i, b_i)
-        self.x = len(ϕ.n_chan) * [None]
-        self.x[0] = b[0] + conv(x[-len(ϕ.n_chan)], w_horz[0])
-        for i in range(1 - len(ϕ.n_chan), 0):
-            self.x[i] = (
-                b[i] + conv(x[i], w_horz[i])
-                + conv(pool(self.x[i-1]), w_vert[i]))
-        self.c_mod = ϕ.k_l2 * (
-            sum(tf.reduce_sum(tf.square(w)) for w in w_horz) +
-            sum(tf.reduce_sum(tf.square(w)) for w in w_vert))
-        self.n_ops = sum(
-            n_pix(x_i) * (
-                n_el(w_horz[i])
-                + (n_el(w_vert[i-1])
-                   if i > 0 else 0))
-            for i, x_i in enumerate(self.x))
+        self.x = conv_max(x, w_horz, w_vert, b)
+        if not self.inference:
+            self.c_mod = ϕ.k_l2 * (
+                sum(tf.reduce_sum(tf.square(w)) for w in w_horz) +
+                sum(tf.reduce_sum(tf.square(w)) for w in w_vert))
+        self.n_ops = conv_max_n_ops(self.x, w_horz, w_vert)
+
+class FoldedMultiscaleConvMax(Layer):
+    default_hypers = Ns(n_chan=[], supp=1)
+
+    def link(self, x, y, mode):
+        super().link(x, y, mode)
+        ϕ, θ = self.hypers, self.params
+        n_in = [x_i.get_shape()[3].value for x_i in x]
+        w_horz = [
+            tf.Variable(tf.zeros((
+                min(ϕ.supp, x[i].get_shape()[1].value),
+                min(ϕ.supp, x[i].get_shape()[2].value),
+                n_in[i], ϕ.n_chan[i])))
+            for i in range(-len(ϕ.n_chan), 0)]
+        w_vert = [
+            tf.Variable(tf.zeros((
+                ϕ.supp, ϕ.supp, ϕ.n_chan[i],
+                ϕ.n_chan[i+1])))
+            for i in range(len(ϕ.n_chan) - 1)]
+        b = [
+            tf.Variable(tf.zeros(x_i.get_shape().as_list()[1:3] + [n_chan_i]))
+            for x_i, n_chan_i in zip(x[-len(ϕ.n_chan):], ϕ.n_chan)]
+        for i, w_i in enumerate(w_horz):
+            setattr(θ, 'w_horz_%i' % i, w_i)
+        for i, w_i in enumerate(w_vert):
+            setattr(θ, 'w_vert_%i' % i, w_i)
+        for i, b_i in enumerate(b):
+            setattr(θ, 'b_%i' % i, b_i)
+        self.x = conv_max(x, w_horz, w_vert, b)
+        self.n_ops = conv_max_n_ops(self.x, w_horz, w_vert)
 
 class MultiscaleRect(Layer):
     def link(self, x, y, mode):
@@ -228,10 +288,19 @@ class BatchNorm(Layer):
         θ.β = tf.Variable(tf.zeros(n_chan))
         θ.m_avg = tf.Variable(tf.zeros(n_chan), trainable=False)
         θ.v_avg = tf.Variable(tf.ones(n_chan), trainable=False)
+        m_batch, v_batch = tf.nn.moments(x, tuple(range(n_dim - 1)))
+        self.m_batch = m_batch
+        self.v_batch = v_batch
+        self.n_batch = tf.shape(x)[0]
         def x_tr():
-            m_batch, v_batch = tf.nn.moments(x, tuple(range(n_dim - 1)))
-            update_m = tf.assign(θ.m_avg, ϕ.d * θ.m_avg + (1 - ϕ.d) * m_batch)
-            update_v = tf.assign(θ.v_avg, ϕ.d * θ.v_avg + (1 - ϕ.d) * v_batch)
+            # Batches can be empty when examples are routed by sampling.
+            has_pts = self.n_batch > 0
+            update_m = tf.cond(has_pts, lambda: tf.identity(tf.assign(
+                θ.m_avg, ϕ.d * θ.m_avg + (1 - ϕ.d) * m_batch)),
+                lambda: tf.identity(θ.m_avg))
+            update_v = tf.cond(has_pts, lambda: tf.identity(tf.assign(
+                θ.v_avg, ϕ.d * θ.v_avg + (1 - ϕ.d) * v_batch)),
+                lambda: tf.identity(θ.v_avg))
             with tf.control_dependencies([update_m, update_v]):
                 return θ.γ * (x - m_batch) / tf.sqrt(v_batch + ϕ.ϵ) + θ.β
         def x_ev():
@@ -290,7 +359,8 @@ class ActivityError(Layer):
     def link(self, x, y, mode):
         super().link(x, y, mode)
         dims = tuple(range(1, len(x.get_shape())))
-        self.c_mod = self.hypers.α * tf.reduce_sum(tf.square(x), dims)
+        if not self.inference:
+            self.c_mod = self.hypers.α * tf.reduce_sum(tf.square(x), dims)
 
 ################################################################################
 # Compound Layers
@@ -304,7 +374,12 @@ class Chain(Layer):
             x = ℓ.x
         self.x = x
         self.c_err = sum(ℓ.c_err for ℓ in self.comps)
-        self.c_mod = sum(ℓ.c_mod for ℓ in self.comps)
+        if not self.inference:
+            self.c_mod = sum(ℓ.c_mod for ℓ in self.comps)
         self.n_ops = sum(ℓ.n_ops for ℓ in self.comps)
         if len(self.comps) > 0 and hasattr(self.comps[-1], 'δ_cor'):
             self.δ_cor = self.comps[-1].δ_cor
+
+    @property
+    def n_mem(self):
+        return max((ℓ.n_mem for ℓ in self.comps), default=self.n_in)
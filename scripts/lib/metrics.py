@@ -0,0 +1,82 @@
+import json
+from collections import deque
+
+import numpy as np
+
+__all__ = ['MetricsRecorder', 'read_metrics', 'summarize_metrics']
+
+################################################################################
+# Recording
+################################################################################
+
+class MetricsRecorder:
+    def __init__(self, path, batch_size, t_flush=100):
+        self.path = path
+        self.batch_size = batch_size
+        self.t_flush = t_flush
+        self.steps = deque(maxlen=t_flush)
+        self.events = []
+        self.hypers = {}
+
+    def step(self, t, t_data, t_step, **hypers):
+        self.steps.append((t_data, t_step))
+        self.hypers = hypers
+        if (t + 1) % self.t_flush == 0:
+            self.flush(t + 1)
+
+    def eval(self, t, t_eval):
+        self.events.append({'kind': 'eval', 't': t, 't_eval': t_eval})
+        self.flush(t)
+
+    def flush(self, t):
+        records = self.events
+        if len(self.steps) > 0:
+            t_data, t_step = map(np.float64, zip(*self.steps))
+            records = [{
+                'kind': 'train', 't': t, 'n_steps': len(self.steps),
+                't_step_p50': np.percentile(t_step, 50),
+                't_step_p90': np.percentile(t_step, 90),
+                't_step_p99': np.percentile(t_step, 99),
+                't_data': np.mean(t_data),
+                't_train': np.sum(t_data + t_step),
+                'ex_per_sec': (
+                    self.batch_size * len(self.steps)
+                    / np.sum(t_data + t_step)),
+                **{k: float(np.mean(v)) for k, v in self.hypers.items()}},
+                *records]
+        if len(records) > 0:
+            with open(self.path, 'a+', encoding='utf-8') as f:
+                for r in records:
+                    f.write(json.dumps(r, ensure_ascii=False) + '\n')
+        self.steps.clear()
+        self.events = []
+
+################################################################################
+# Reading
+################################################################################
+
+def read_metrics(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def summarize_metrics(records):
+    train = [r for r in records if r['kind'] == 'train']
+    n_steps = sum(r['n_steps'] for r in train)
+    t_train = sum(r['t_train'] for r in train)
+    t_eval = sum(r['t_eval'] for r in records if r['kind'] == 'eval')
+    step_mean = lambda k: (
+        sum(r['n_steps'] * r[k] for r in train) / n_steps
+        if n_steps > 0 else np.nan)
+    return {
+        't': max((r['t'] for r in records), default=0),
+        't_step_p50': step_mean('t_step_p50'),
+        't_step_p90': step_mean('t_step_p90'),
+        't_step_p99': max((r['t_step_p99'] for r in train), default=np.nan),
+        't_data': step_mean('t_data'),
+        'ex_per_sec': (
+            sum(r['ex_per_sec'] * r['t_train'] for r in train) / t_train
+            if t_train > 0 else np.nan),
+        't_train': t_train,
+        't_eval': t_eval,
+        **{k: v for k, v in (train[-1] if train else {}).items()
+           if k in ('λ_lrn', 'τ')}}
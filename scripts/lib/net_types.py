@@ -15,27 +15,147 @@ def n_leaves(ℓ): return (
     1 if len(ℓ.sinks) == 0
     else sum(map(n_leaves, ℓ.sinks)))
 
+def link_mem(ℓ, n_mem_path=0):
+    ℓ.n_mem_path = max(n_mem_path, ℓ.n_mem, getattr(ℓ.router, 'n_mem', 0))
+    for s in ℓ.sinks:
+        link_mem(s, ℓ.n_mem_path)
+
+def mark_inference(ℓ):
+    if ℓ is not None:
+        ℓ.inference = True
+        for c in [*ℓ.comps, *ℓ.sinks, ℓ.router]:
+            mark_inference(c)
+
 def params_list_rec(ℓ):
     if ℓ is not None:
         yield from vars(ℓ.params).values()
         for c in getattr(ℓ, 'comps', []):
             yield from params_list_rec(c)
 
-def minimize_expectation(layers, cost, optimizer, α_rtr=1, talr=True):
-    lr_scale = lambda ℓ: (
-        1 / tf.sqrt(tf.reduce_mean(tf.square(ℓ.p_tr)))
-        if talr else 1)
-    lr_scales = {
-        **{θ: lr_scale(ℓ)
+def lr_scale_terms(layers, α_rtr=1, talr=True, ms_min=0):
+    ms_p_tr = lambda ℓ: (
+        tf.maximum(tf.reduce_mean(tf.square(ℓ.p_tr)), ms_min)
+        if talr else tf.ones(()))
+    return {
+        **{θ: (1, ms_p_tr(ℓ))
            for ℓ in layers
            for θ in params_list_rec(ℓ)},
-        **{θ: α_rtr * lr_scale(ℓ)
+        **{θ: (α_rtr, ms_p_tr(ℓ))
            for ℓ in layers
            for θ in params_list_rec(ℓ.router)}}
+
+def minimize_expectation(scale_terms, cost, optimizer):
+    lr_scale = lambda θ: scale_terms[θ][0] / tf.sqrt(scale_terms[θ][1])
     grads = optimizer.compute_gradients(cost)
-    scaled_grads = [(lr_scales[θ] * g, θ) for g, θ in grads if g is not None]
+    scaled_grads = [(lr_scale(θ) * g, θ) for g, θ in grads if g is not None]
     return optimizer.apply_gradients(scaled_grads)
 
+def link_router(ℓ, y, mode, k_cpt=None, α_cpt=0):
+    def concat_k_cpt(x_):
+        # The batch size is dynamic, so the static shape is set explicitly,
+        # for operation and activation counts.
+        n_in = int(np.prod(x_.get_shape().as_list()[1:]))
+        x_rte = tf.concat(1, [
+            tf.reshape(x_, (tf.shape(x_)[0], n_in)),
+            α_cpt * k_cpt[:, None]
+            * tf.ones((tf.shape(x_)[0], 1))])
+        x_rte.set_shape((None, n_in + 1))
+        return x_rte
+    if k_cpt is None:
+        x_rte = ℓ.x
+    elif isinstance(ℓ.x, list):
+        x_rte = list(map(concat_k_cpt, ℓ.x))
+    else:
+        x_rte = concat_k_cpt(ℓ.x)
+    ℓ.router.link(x_rte, y, mode)
+
+################################################################################
+# Sampled-Path Routing
+################################################################################
+
+def gather_pts(x, idx):
+    return (
+        [tf.gather(x_i, idx) for x_i in x] if isinstance(x, list)
+        else tf.gather(x, idx))
+
+def scatter_pts(x, idx, n_pts):
+    return (
+        tf.unsorted_segment_sum(x, idx, n_pts)
+        if x.get_shape().ndims > 0 else x)
+
+def tile_pts(x, n_rep):
+    n_dims = len(x.get_shape())
+    return tf.tile(x, tf.concat(0, [
+        tf.reshape(n_rep, (1,)), tf.ones((n_dims - 1,), tf.int32)]))
+
+def link_sampled(net):
+    # Each example is replicated `n_paths` times during training, and every
+    # replica follows a single path, sampled from the training-time routing
+    # policy (or chosen greedily at evaluation time). Each layer is only
+    # evaluated on the examples routed to it, and per-example outputs are
+    # scattered back into full-batch tensors, which are zero off the path.
+    # `p_tr` is the product of π / stop_gradient(π) along the path, so it is
+    # 1 on the path, but carries score-function gradients.
+    ϕ = net.hypers
+    is_tr = tf.equal(net.mode, 'tr')
+    n_rep = tf.cond(
+        is_tr, lambda: tf.constant(ϕ.n_paths),
+        lambda: tf.constant(1))
+    x0 = tile_pts(net.x0, n_rep)
+    y = tile_pts(net.y, n_rep)
+    # A single k_cpt can be fed for a whole batch, as in full-expectation nets.
+    k_cpt = (
+        tile_pts(net.k_cpt * tf.ones((tf.shape(net.x0)[0],)), n_rep)
+        if ϕ.dyn_k_cpt else net.k_cpt)
+    n_pts = tf.shape(x0)[0]
+    def link_layer(ℓ, x, idx, p_tr):
+        y_ℓ = tf.gather(y, idx)
+        ℓ.link(x, y_ℓ, net.mode)
+        if ℓ.router is not None:
+            link_router(
+                ℓ, y_ℓ, net.mode,
+                tf.gather(k_cpt, idx) if ϕ.dyn_k_cpt else None,
+                ϕ.α_cpt)
+        ℓ.p_tr = p_tr
+        ℓ.p_ev = scatter_pts(tf.ones(tf.shape(idx)), idx, n_pts)
+        if len(ℓ.sinks) < 2:
+            for s in ℓ.sinks:
+                link_layer(s, ℓ.x, idx, p_tr)
+        else:
+            n_sinks = len(ℓ.sinks)
+            π_tr = (
+                (1 - net.ϵ) * tf.nn.softmax(ℓ.router.x / net.τ)
+                + [net.ϵ * n_leaves(s) / n_leaves(ℓ) for s in ℓ.sinks])
+            i_rte = tf.cond(
+                is_tr,
+                lambda: tf.to_int32(tf.multinomial(tf.log(π_tr), 1)[:, 0]),
+                lambda: tf.to_int32(tf.argmax(ℓ.router.x, 1)))
+            δ_rte = tf.to_float(tf.equal(
+                tf.expand_dims(i_rte, 1), tf.range(n_sinks)))
+            ρ_rte = δ_rte * π_tr / tf.stop_gradient(π_tr)
+            for i, s in enumerate(ℓ.sinks):
+                sel = tf.to_int32(tf.reshape(
+                    tf.where(tf.equal(i_rte, i)), (-1,)))
+                link_layer(
+                    s, gather_pts(ℓ.x, sel), tf.gather(idx, sel),
+                    p_tr * scatter_pts(ρ_rte[:, i], idx, n_pts))
+            ℓ.π_tr = scatter_pts(π_tr, idx, n_pts)
+            ℓ.δ_rte = scatter_pts(δ_rte, idx, n_pts)
+            ℓ.router.x = scatter_pts(ℓ.router.x, idx, n_pts)
+        for k in ('c_err', 'c_mod', 'δ_cor'):
+            if hasattr(ℓ, k):
+                setattr(ℓ, k, scatter_pts(getattr(ℓ, k), idx, n_pts))
+        if len(ℓ.sinks) == 0:
+            ℓ.x = scatter_pts(ℓ.x, idx, n_pts)
+    link_layer(net.root, x0, tf.range(n_pts), tf.ones((n_pts,)))
+    return k_cpt
+
+def link_path_costs(ℓ, c_own):
+    ℓ.c_path = tf.stop_gradient(
+        ℓ.p_ev * c_own(ℓ)
+        + sum(link_path_costs(s, c_own) for s in ℓ.sinks))
+    return ℓ.c_path
+
 ################################################################################
 # Root Network Class
 ################################################################################
@@ -51,6 +171,8 @@ class Net(metaclass=ABCMeta):
         self.y = tf.placeholder(tf.float32, (None,) + self.hypers.y_shape)
         self.mode = tf.placeholder_with_default('ev', ())
         self.train = tf.no_op()
+        if getattr(self.hypers, 'inference', False):
+            mark_inference(self.root)
         self.link()
 
     def link(self):
@@ -61,6 +183,7 @@ class Net(metaclass=ABCMeta):
             for s in ℓ.sinks:
                 link_layer(s, ℓ.x, y, mode)
         link_layer(self.root, self.x0, self.y, self.mode)
+        link_mem(self.root)
 
     @property
     def layers(self):
@@ -83,7 +206,7 @@ class Net(metaclass=ABCMeta):
 ################################################################################
 
 class SRNet(Net):
-    default_hypers = Ns(λ_lrn=1e-3, μ_lrn=0.9)
+    default_hypers = Ns(λ_lrn=1e-3, μ_lrn=0.9, inference=False)
 
     def link(self):
         super().link()
@@ -92,9 +215,13 @@ class SRNet(Net):
         self.μ_lrn = tf.placeholder_with_default(ϕ.μ_lrn, ())
         for ℓ in self.layers:
             ℓ.p_ev = tf.ones((tf.shape(self.x0)[0],))
-        c_tot = tf.reduce_mean(sum(ℓ.c_err + ℓ.c_mod for ℓ in self.layers))
+        if ϕ.inference:
+            return
+        self.c_tot = tf.reduce_mean(
+            sum(ℓ.c_err + ℓ.c_mod for ℓ in self.layers))
+        self.lr_scale_terms = {}
         opt = tf.train.MomentumOptimizer(self.λ_lrn, self.μ_lrn)
-        self.train = opt.minimize(c_tot)
+        self.train = opt.minimize(self.c_tot)
 
 ################################################################################
 # Actor Networks
@@ -102,8 +229,9 @@ class SRNet(Net):
 
 class ActorNet(Net):
     default_hypers = Ns(
-        k_cpt=0.0, k_dec=0.01, ϵ=1e-6, τ=1.0, λ_lrn=1e-3, μ_lrn=0.9,
-        dyn_k_cpt=False, α_cpt=1e7, talr=True, α_rtr=1.0)
+        k_cpt=0.0, k_mem=0.0, k_dec=0.01, ϵ=1e-6, τ=1.0, λ_lrn=1e-3,
+        μ_lrn=0.9, dyn_k_cpt=False, α_cpt=1e7, talr=True, α_rtr=1.0,
+        inference=False, n_paths=0, bsl=True)
 
     def _route(self, ℓ, p_tr, p_ev):
         ℓ.p_tr = p_tr
@@ -134,6 +262,13 @@ class ActorNet(Net):
         dims = tuple(range(1, len(ℓ.router.x.get_shape())))
         return self.hypers.k_dec * tf.reduce_sum(tf.square(ℓ.router.x), dims)
 
+    def _c_bsl(self, ℓ):
+        # A leave-one-out baseline for the cost downstream of each decision.
+        c_down = sum(s.c_path for s in ℓ.sinks)
+        n_pts = tf.reduce_sum(ℓ.p_ev)
+        b = (tf.reduce_sum(c_down) - c_down) / tf.maximum(n_pts - 1, 1)
+        return -b * (sum(s.p_tr for s in ℓ.sinks) - ℓ.p_tr)
+
     def link(self):
         ϕ = self.hypers
         self.λ_lrn = tf.placeholder_with_default(ϕ.λ_lrn, ())
@@ -146,39 +281,49 @@ class ActorNet(Net):
         def link_layer(ℓ, x, y, mode):
             ℓ.link(x, y, mode)
             if ℓ.router is not None:
-                concat_k_cpt = lambda x_: tf.concat(1, [
-                    tf.reshape(x_, (
-                        tf.shape(x_)[0],
-                        np.prod(x_.get_shape().as_list()[1:]))),
-                    ϕ.α_cpt * self.k_cpt[:, None]
-                    * tf.ones((tf.shape(x_)[0], 1))])
-                if not ϕ.dyn_k_cpt:
-                    x_rte = ℓ.x
-                elif isinstance(ℓ.x, list):
-                    x_rte = list(map(concat_k_cpt, ℓ.x))
-                else:
-                    x_rte = concat_k_cpt(ℓ.x)
-                ℓ.router.link(x_rte, y, mode)
+                link_router(
+                    ℓ, y, mode, self.k_cpt if ϕ.dyn_k_cpt else None,
+                    ϕ.α_cpt)
             for s in ℓ.sinks:
                 link_layer(s, ℓ.x, y, mode)
-        link_layer(self.root, self.x0, self.y, self.mode)
-        n_pts = tf.shape(self.x0)[0]
-        self._route(self.root, tf.ones((n_pts,)), tf.ones((n_pts,)))
+        if ϕ.n_paths > 0:
+            k_cpt = link_sampled(self)
+            link_mem(self.root)
+        else:
+            k_cpt = self.k_cpt
+            link_layer(self.root, self.x0, self.y, self.mode)
+            link_mem(self.root)
+            n_pts = tf.shape(self.x0)[0]
+            self._route(self.root, tf.ones((n_pts,)), tf.ones((n_pts,)))
+        if ϕ.inference:
+            return
         c_err = sum(ℓ.p_tr * ℓ.c_err for ℓ in self.layers)
         c_cpt = sum(
-            ℓ.p_tr * self.k_cpt * (ℓ.n_ops + getattr(ℓ.router, 'n_ops', 0))
+            ℓ.p_tr * k_cpt * (ℓ.n_ops + getattr(ℓ.router, 'n_ops', 0))
             for ℓ in self.layers)
+        c_mem = sum(
+            ℓ.p_tr * ϕ.k_mem * ℓ.n_mem_path
+            for ℓ in self.leaves)
         c_mod = sum(
             tf.stop_gradient(ℓ.p_tr) * (ℓ.c_mod + getattr(ℓ.router, 'c_mod', 0))
             for ℓ in self.layers)
         c_dec = sum(
             tf.stop_gradient(ℓ.p_tr) * self._c_dec(ℓ)
             for ℓ in self.switches)
-        c_tot = tf.reduce_mean(c_err + c_cpt + c_mod + c_dec)
+        c_bsl = 0
+        if ϕ.n_paths > 0 and ϕ.bsl:
+            link_path_costs(self.root, lambda ℓ: (
+                ℓ.c_err
+                + k_cpt * (ℓ.n_ops + getattr(ℓ.router, 'n_ops', 0))
+                + (ϕ.k_mem * ℓ.n_mem_path if len(ℓ.sinks) == 0 else 0)))
+            c_bsl = sum(map(self._c_bsl, self.switches))
+        self.c_tot = tf.reduce_mean(
+            c_err + c_cpt + c_mem + c_mod + c_dec + c_bsl)
+        self.lr_scale_terms = lr_scale_terms(
+            list(self.layers), ϕ.α_rtr, ϕ.talr,
+            1e-12 if ϕ.n_paths > 0 else 0)
         opt = tf.train.MomentumOptimizer(self.λ_lrn, self.μ_lrn)
-        self.train = minimize_expectation(
-            list(self.layers), c_tot, opt,
-            self.hypers.α_rtr, self.hypers.talr)
+        self.train = minimize_expectation(self.lr_scale_terms, self.c_tot, opt)
 
 ################################################################################
 # Critic Networks
@@ -186,9 +331,9 @@ class ActorNet(Net):
 
 class CriticNet(Net):
     default_hypers = Ns(
-        k_cpt=0.0, k_cre=1e-3, ϵ=1e-6, τ=0.01, optimistic=False,
+        k_cpt=0.0, k_mem=0.0, k_cre=1e-3, ϵ=1e-6, τ=0.01, optimistic=False,
         dyn_k_cpt=False, α_cpt=1e7, use_cls_err=False, λ_lrn=1e-3, μ_lrn=0.9,
-        talr=True, α_rtr=1.0)
+        talr=True, α_rtr=1.0, inference=False, n_paths=0, w_max=10.0)
 
     def _route(self, ℓ, p_tr, p_ev):
         ℓ.p_tr = p_tr
@@ -202,14 +347,17 @@ class CriticNet(Net):
         for s in ℓ.sinks:
             self._route(s, ℓ.p_tr, ℓ.p_ev)
         ϕ = self.hypers
+        if ϕ.inference:
+            return
         c_err = (
             (1 - getattr(ℓ, 'δ_cor', 1))
             if ϕ.use_cls_err else ℓ.c_err)
+        c_mem = ϕ.k_mem * ℓ.n_mem_path if len(ℓ.sinks) == 0 else 0
         ℓ.c_ev = (
-            c_err + self.k_cpt * ℓ.n_ops
+            c_err + self.k_cpt * ℓ.n_ops + c_mem
             + sum(s.c_ev for s in ℓ.sinks))
         ℓ.c_opt = (
-            c_err + self.k_cpt * ℓ.n_ops
+            c_err + self.k_cpt * ℓ.n_ops + c_mem
             + sum(s.c_opt for s in ℓ.sinks))
         ℓ.c_cre = 0
 
@@ -229,6 +377,8 @@ class CriticNet(Net):
             tf.range(len(ℓ.sinks))))
         for i, s in enumerate(ℓ.sinks):
             self._route(s, ℓ.p_tr * π_tr[:, i], ℓ.p_ev * π_ev[:, i])
+        if ϕ.inference:
+            return
         ℓ.c_ev = (
             c_err + self.k_cpt * (ℓ.n_ops + ℓ.router.n_ops)
             + sum(π_ev[:, i] * s.c_ev
@@ -242,8 +392,34 @@ class CriticNet(Net):
                     s.c_opt if ϕ.optimistic else s.c_ev))
                 for i, s in enumerate(ℓ.sinks)))
 
+    def _c_own(self, ℓ, k_cpt):
+        ϕ = self.hypers
+        c_err = (
+            (1 - getattr(ℓ, 'δ_cor', 1))
+            if ϕ.use_cls_err else ℓ.c_err)
+        c_mem = ϕ.k_mem * ℓ.n_mem_path if len(ℓ.sinks) == 0 else 0
+        return (
+            c_err + k_cpt * (ℓ.n_ops + getattr(ℓ.router, 'n_ops', 0))
+            + c_mem)
+
+    def _c_cre_sampled(self, ℓ):
+        # Only the sampled sink's cost is observed, so it is weighted by its
+        # (clipped) inverse sampling probability. The regression target is the
+        # cost of the sampled path below the sink, rather than that of the
+        # greedy path, which is not evaluated in this mode.
+        ϕ = self.hypers
+        w = tf.minimum(1 / tf.stop_gradient(ℓ.π_tr), ϕ.w_max)
+        return ϕ.k_cre * sum(
+            ℓ.δ_rte[:, i] * w[:, i]
+            * tf.square(ℓ.router.x[:, i] + s.c_path)
+            for i, s in enumerate(ℓ.sinks))
+
     def link(self):
         ϕ = self.hypers
+        if ϕ.n_paths > 0 and ϕ.optimistic:
+            raise ValueError(
+                'optimistic critic networks cannot be trained on sampled '
+                'paths')
         self.λ_lrn = tf.placeholder_with_default(ϕ.λ_lrn, ())
         self.μ_lrn = tf.placeholder_with_default(ϕ.μ_lrn, ())
         self.ϵ = tf.placeholder_with_default(ϕ.ϵ, ())
@@ -254,31 +430,36 @@ class CriticNet(Net):
         def link_layer(ℓ, x, y, mode):
             ℓ.link(x, y, mode)
             if ℓ.router is not None:
-                concat_k_cpt = lambda x_: tf.concat(1, [
-                    tf.reshape(x_, (
-                        tf.shape(x_)[0],
-                        np.prod(x_.get_shape().as_list()[1:]))),
-                    ϕ.α_cpt * self.k_cpt[:, None]
-                    * tf.ones((tf.shape(x_)[0], 1))])
-                if not ϕ.dyn_k_cpt:
-                    x_rte = ℓ.x
-                elif isinstance(ℓ.x, list):
-                    x_rte = list(map(concat_k_cpt, ℓ.x))
-                else:
-                    x_rte = concat_k_cpt(ℓ.x)
-                ℓ.router.link(x_rte, y, mode)
+                link_router(
+                    ℓ, y, mode, self.k_cpt if ϕ.dyn_k_cpt else None,
+                    ϕ.α_cpt)
             for s in ℓ.sinks:
                 link_layer(s, ℓ.x, y, mode)
-        link_layer(self.root, self.x0, self.y, self.mode)
-        n_pts = tf.shape(self.x0)[0]
-        self._route(self.root, tf.ones((n_pts,)), tf.ones((n_pts,)))
+        if ϕ.n_paths > 0:
+            k_cpt = link_sampled(self)
+            link_mem(self.root)
+        else:
+            k_cpt = self.k_cpt
+            link_layer(self.root, self.x0, self.y, self.mode)
+            link_mem(self.root)
+            n_pts = tf.shape(self.x0)[0]
+            self._route(self.root, tf.ones((n_pts,)), tf.ones((n_pts,)))
+        if ϕ.inference:
+            return
+        if ϕ.n_paths > 0:
+            link_path_costs(self.root, lambda ℓ: self._c_own(ℓ, k_cpt))
+            for ℓ in self.layers:
+                ℓ.c_cre = (
+                    self._c_cre_sampled(ℓ)
+                    if len(ℓ.sinks) > 1 else 0)
         c_err = sum(tf.stop_gradient(ℓ.p_tr) * ℓ.c_err for ℓ in self.layers)
         c_cre = sum(tf.stop_gradient(ℓ.p_tr) * ℓ.c_cre for ℓ in self.layers)
         c_mod = sum(
             tf.stop_gradient(ℓ.p_tr) * (ℓ.c_mod + getattr(ℓ.router, 'c_mod', 0))
             for ℓ in self.layers)
-        c_tot = tf.reduce_mean(c_err + c_cre + c_mod)
+        self.c_tot = tf.reduce_mean(c_err + c_cre + c_mod)
+        self.lr_scale_terms = lr_scale_terms(
+            list(self.layers), ϕ.α_rtr, ϕ.talr,
+            1e-12 if ϕ.n_paths > 0 else 0)
         opt = tf.train.MomentumOptimizer(self.λ_lrn, self.μ_lrn)
-        self.train = minimize_expectation(
-            list(self.layers), c_tot, opt,
-            self.hypers.α_rtr, self.hypers.talr)
+        self.train = minimize_expectation(self.lr_scale_terms, self.c_tot, opt)
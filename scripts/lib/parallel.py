@@ -0,0 +1,179 @@
+from multiprocessing import cpu_count, get_context
+from types import SimpleNamespace as Ns
+
+import numpy as np
+import tensorflow as tf
+
+from lib.layer_types import BatchNorm
+from lib.net_types import params_list_rec
+from lib.tuning import read_profile, session_config
+
+__all__ = ['net_params', 'DataParallelTrainer']
+
+################################################################################
+# Support Functions
+################################################################################
+
+def net_params(net):
+    for ℓ in net.layers:
+        yield from params_list_rec(ℓ)
+        yield from params_list_rec(ℓ.router)
+    yield from vars(net.params).values()
+
+def batch_norms(ℓ):
+    if ℓ is not None:
+        if isinstance(ℓ, BatchNorm):
+            yield ℓ
+        for c in getattr(ℓ, 'comps', []):
+            yield from batch_norms(c)
+
+def net_batch_norms(net):
+    for ℓ in net.layers:
+        yield from batch_norms(ℓ)
+        yield from batch_norms(ℓ.router)
+
+def pooled_moments(moments):
+    # Combines per-shard batch moments into the moments of the full batch, so
+    # that the running averages match those of single-process training.
+    m, v, n = map(np.float64, zip(*moments))
+    n = n.reshape((-1,) + (1,) * (m.ndim - 1))
+    n_tot = np.sum(n, 0)
+    if n_tot.max() == 0:
+        return None
+    m_tot = np.sum(n * np.nan_to_num(m), 0) / n_tot
+    v_tot = np.sum(n * np.nan_to_num(v + np.square(m - m_tot)), 0) / n_tot
+    return m_tot, v_tot
+
+def trainable(θs):
+    θs_tr = set(tf.trainable_variables())
+    return [θ for θ in θs if θ in θs_tr]
+
+def placeholder_like(θ):
+    return tf.placeholder(θ.dtype.base_dtype, θ.get_shape())
+
+################################################################################
+# Gradient Workers
+################################################################################
+
+def link_worker(make_net, x0_shape, y_shape, n_threads):
+    w = Ns()
+    w.graph = tf.Graph()
+    with w.graph.as_default():
+        w.net = make_net(x0_shape, y_shape)
+        w.θs = list(net_params(w.net))
+        w.θs_tr = trainable(w.θs)
+        w.moments = [
+            (ℓ.m_batch, ℓ.v_batch, ℓ.n_batch)
+            for ℓ in net_batch_norms(w.net)]
+        w.grads = [
+            tf.zeros_like(θ) if g is None else g
+            for g, θ in zip(tf.gradients(w.net.c_tot, w.θs_tr), w.θs_tr)]
+        w.ms_p_tr = [
+            w.net.lr_scale_terms.get(θ, (1, tf.ones(())))[1]
+            for θ in w.θs_tr]
+        w.θ_in = list(map(placeholder_like, w.θs))
+        w.load = tf.group(*(
+            tf.assign(θ, v) for θ, v in zip(w.θs, w.θ_in)))
+        w.sess = tf.Session(config=tf.ConfigProto(
+            intra_op_parallelism_threads=n_threads,
+            inter_op_parallelism_threads=n_threads))
+    return w
+
+def run_worker(conn, make_nets, hypers, x0_shape, y_shape, n_threads):
+    w = None
+    while True:
+        cmd, *args = conn.recv()
+        if cmd == 'link':
+            if w is not None:
+                w.sess.close()
+            w = link_worker(make_nets[args[0]], x0_shape, y_shape, n_threads)
+        elif cmd == 'load':
+            w.sess.run(w.load, dict(zip(w.θ_in, args[0])))
+        elif cmd == 'step':
+            t, x0, y = args
+            conn.send(w.sess.run(
+                [w.grads, w.ms_p_tr, w.moments, w.net.c_tot], {
+                    w.net.x0: x0, w.net.y: y, w.net.mode: 'tr',
+                    **hypers(w.net, t)}))
+        elif cmd == 'close':
+            break
+
+################################################################################
+# Parameter-Averaging Coordinator
+################################################################################
+
+class DataParallelTrainer:
+    def __init__(self, n_workers, make_nets, hypers, x0_shape, y_shape):
+        ctx = get_context('fork')
+        self.n_threads = max(1, cpu_count() // n_workers)
+        self.conns = []
+        self.procs = []
+        for _ in range(n_workers):
+            conn, worker_conn = ctx.Pipe()
+            proc = ctx.Process(target=run_worker, daemon=True, args=(
+                worker_conn, make_nets, hypers, x0_shape, y_shape,
+                self.n_threads))
+            proc.start()
+            self.conns.append(conn)
+            self.procs.append(proc)
+
+    def link(self, i, net):
+        for conn in self.conns:
+            conn.send(('link', i))
+        self.net = net
+        self.θs = list(net_params(net))
+        self.θs_tr = trainable(self.θs)
+        self.bns = list(net_batch_norms(net))
+        self.α = [net.lr_scale_terms.get(θ, (1, None))[0] for θ in self.θs_tr]
+        self.g_in = list(map(placeholder_like, self.θs_tr))
+        opt = tf.train.MomentumOptimizer(net.λ_lrn, net.μ_lrn)
+        self.apply = opt.apply_gradients(list(zip(self.g_in, self.θs_tr)))
+        self.moments_in = [
+            (placeholder_like(ℓ.params.m_avg), placeholder_like(ℓ.params.v_avg))
+            for ℓ in self.bns]
+        self.update_avg = [
+            tf.group(
+                tf.assign(ℓ.params.m_avg, ℓ.hypers.d * ℓ.params.m_avg
+                          + (1 - ℓ.hypers.d) * m_in),
+                tf.assign(ℓ.params.v_avg, ℓ.hypers.d * ℓ.params.v_avg
+                          + (1 - ℓ.hypers.d) * v_in))
+            for ℓ, (m_in, v_in) in zip(self.bns, self.moments_in)]
+
+    def session_config(self, net_type=None):
+        return session_config({
+            **read_profile(net_type),
+            'inter_op_threads': self.n_threads,
+            'intra_op_threads': self.n_threads})
+
+    def sync(self):
+        θ_vals = tf.get_default_session().run(self.θs)
+        for conn in self.conns:
+            conn.send(('load', θ_vals))
+
+    def step(self, t, x0, y, λ_lrn):
+        shards = np.array_split(np.arange(len(x0)), len(self.conns))
+        for conn, s in zip(self.conns, shards):
+            conn.send(('step', t, x0[s], y[s]))
+        results = [conn.recv() for conn in self.conns]
+        w = [len(s) / len(x0) for s in shards]
+        mean = lambda k, j: sum(w_n * r[k][j] for w_n, r in zip(w, results))
+        tf.get_default_session().run(self.apply, {
+            self.net.λ_lrn: λ_lrn,
+            **{g: α * mean(0, j) / np.sqrt(mean(1, j))
+               for j, (g, α) in enumerate(zip(self.g_in, self.α))}})
+        updates, feed = [], {}
+        for j, update in enumerate(self.update_avg):
+            moments = pooled_moments([r[2][j] for r in results])
+            if moments is not None:
+                updates.append(update)
+                feed.update(zip(self.moments_in[j], moments))
+        if len(updates) > 0:
+            tf.get_default_session().run(updates, feed)
+        self.sync()
+        return sum(w_n * r[3] for w_n, r in zip(w, results))
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(('close',))
+        for proc in self.procs:
+            proc.join()
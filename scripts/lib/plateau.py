@@ -0,0 +1,33 @@
+__all__ = ['PlateauMonitor']
+
+################################################################################
+# Plateau Detection
+################################################################################
+
+class PlateauMonitor:
+    def __init__(self, tol=1e-3, patience=3):
+        self.tol = tol
+        self.patience = patience
+        self.prev = None
+        self.n_stale = 0
+        self.gains = {}
+
+    def update(self, acc, moc, c_tr):
+        if self.prev is not None:
+            acc_0, moc_0, c_tr_0 = self.prev
+            self.gains = {
+                'Δacc': acc - acc_0,
+                'Δmoc': abs(moc - moc_0) / max(moc_0, 1),
+                'Δc_tr': (c_tr_0 - c_tr) / max(abs(c_tr_0), 1e-12)}
+            stale = max(self.gains.values()) < self.tol
+            self.n_stale = self.n_stale + 1 if stale else 0
+        self.prev = (acc, moc, c_tr)
+        return self.n_stale >= self.patience
+
+    def reset(self):
+        self.n_stale = 0
+
+    def render(self):
+        return 'Plateau monitor: %s; %i/%i stale windows' % (
+            ', '.join('%s=%.3g' % i for i in sorted(self.gains.items())),
+            self.n_stale, self.patience)
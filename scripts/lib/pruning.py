@@ -0,0 +1,34 @@
+import numpy as np
+
+__all__ = ['prune_net_record']
+
+################################################################################
+# Record Pruning
+################################################################################
+
+def prune_router(record, keep):
+    out = record['comps'][-1]
+    out_pruned = {
+        **out, 'hypers': {**out['hypers'], 'n_chan': len(keep)},
+        'params': {'w': out['params']['w'][:, keep],
+                   'b': out['params']['b'][keep]}}
+    return {**record, 'comps': record['comps'][:-1] + [out_pruned]}
+
+def prune_layer(record, desc, threshold):
+    usage = [s['stats_tr']['p_ev'] for s in desc['sinks']]
+    keep = (
+        list(range(len(usage))) if len(usage) < 2
+        else [i for i, u in enumerate(usage) if u >= threshold]
+        or [int(np.argmax(usage))])
+    sinks = [
+        prune_layer(record['sinks'][i], desc['sinks'][i], threshold)
+        for i in keep]
+    router = (
+        None if len(keep) < 2
+        else record['router'] if len(keep) == len(usage)
+        else prune_router(record['router'], keep))
+    return {**record, 'sinks': sinks, 'router': router}
+
+def prune_net_record(record, desc, threshold):
+    return {**record, 'root': prune_layer(
+        record['root'], desc['root'], threshold)}
@@ -4,7 +4,7 @@ import tensorflow as tf
 import lib.layer_types
 import lib.net_types
 
-__all__ = ['encode_net', 'decode_net', 'write_net', 'read_net']
+__all__ = ['encode_net', 'decode_net', 'write_net', 'read_net', 'read_params']
 
 ################################################################################
 # Layer Serialization/Deserialization
@@ -43,14 +43,17 @@ def encode_net(net):
         root=encode_layer(net.root), hypers=vars(net.hypers),
         params={k: v.eval() for k, v in vars(net.params).items()})
 
-def decode_net(record):
-    type_ = getattr(lib.net_types, record['type'])
-    root = decode_layer(record['root'])
-    net = type_(root=root, **record['hypers'])
+def load_net_params(net, record):
     load_params(net.root, record['root']).run()
     tf.group(*(
         tf.assign(getattr(net.params, k), v)
         for k, v in record['params'].items())).run()
+
+def decode_net(record):
+    type_ = getattr(lib.net_types, record['type'])
+    root = decode_layer(record['root'])
+    net = type_(root=root, **record['hypers'])
+    load_net_params(net, record)
     return net
 
 def write_net(path, net):
@@ -58,3 +61,6 @@ def write_net(path, net):
 
 def read_net(path):
     return decode_net(np.load(path)[()])
+
+def read_params(path, net):
+    load_net_params(net, np.load(path)[()])
@@ -0,0 +1,66 @@
+from os.path import exists, splitext
+
+import numpy as np
+
+__all__ = ['trace_path', 'write_trace', 'read_trace',
+           'leaf_stats', 'annotate_desc', 'load_desc']
+
+################################################################################
+# Trace Storage
+################################################################################
+
+def trace_path(stats_path):
+    return splitext(stats_path)[0] + '.trace.npz'
+
+def write_trace(path, trace):
+    np.savez_compressed(path, **trace)
+
+def read_trace(path):
+    with np.load(path) as archive:
+        return {k: archive[k] for k in archive.files}
+
+################################################################################
+# Trace Statistics
+################################################################################
+
+def leaf_stats(trace):
+    n_pts = len(trace['leaf'])
+    n_leaves = int(trace['n_leaves'])
+    n_cls = int(trace['n_cls'])
+    leaf = np.int64(trace['leaf'])
+    cor = np.float64(trace['cor'])
+    i_cls = leaf * n_cls + trace['cls']
+    n_ev = np.bincount(leaf, minlength=n_leaves)
+    n_cor = np.bincount(leaf, cor, n_leaves)
+    n_cor_by_cls = np.bincount(i_cls, cor, n_leaves * n_cls)
+    n_ev_by_cls = np.bincount(i_cls, minlength=n_leaves * n_cls)
+    return {'p_cor': n_cor / n_pts,
+            'p_inc': (n_ev - n_cor) / n_pts,
+            'p_cor_by_cls': np.reshape(
+                n_cor_by_cls / n_pts, (n_leaves, n_cls)),
+            'p_inc_by_cls': np.reshape(
+                (n_ev_by_cls - n_cor_by_cls) / n_pts, (n_leaves, n_cls))}
+
+def leaf_descs(desc):
+    if len(desc['sinks']) == 0:
+        yield desc
+    for s in desc['sinks']:
+        yield from leaf_descs(s)
+
+def annotate_desc(desc, trace):
+    stats = leaf_stats(trace)
+    for i, ℓ in enumerate(leaf_descs(desc['root'])):
+        ℓ['stats_ts'].update({k: v[i].tolist() for k, v in stats.items()})
+    desc['stats_ts'].update(
+        acc=float(np.mean(trace['cor'])),
+        moc=float(np.mean(trace['n_ops'])))
+    if 'n_mem_path' in trace:
+        desc['stats_ts']['mpm'] = float(
+            np.mean(trace['n_mem_path'][trace['leaf']]))
+    return desc
+
+def load_desc(stats_path):
+    desc = np.load(stats_path)[()]
+    if exists(trace_path(stats_path)):
+        annotate_desc(desc, read_trace(trace_path(stats_path)))
+    return desc
@@ -0,0 +1,59 @@
+from os.path import exists
+
+import numpy as np
+import tensorflow as tf
+
+__all__ = ['profile_path', 'default_profile', 'net_type_key', 'record_type_key',
+           'read_profile', 'write_profile', 'session_config']
+
+################################################################################
+# Execution Profiles
+################################################################################
+
+profile_path = 'cpu-profile.npy'
+
+default_profile = {
+    'net_type': None,
+    'inter_op_threads': 0,
+    'intra_op_threads': 0,
+    'batch_size_ev': 128}
+
+def type_key(type_name, root, sinks, hypers):
+    prefix = {'SRNet': 'sr', 'ActorNet': 'ac', 'CriticNet': 'cr'}.get(type_name)
+    n_branches = lambda ℓ: sum(len(sinks(s)) > 0 for s in sinks(ℓ))
+    def has_branches(ℓ):
+        return n_branches(ℓ) > 1 or any(map(has_branches, sinks(ℓ)))
+    shape = 'tree' if has_branches(root) else 'chain'
+    suffix = '-sampled' if hypers.get('n_paths', 0) > 0 else ''
+    return None if prefix is None else '%s-%s%s' % (prefix, shape, suffix)
+
+def net_type_key(net):
+    return type_key(
+        type(net).__name__, net.root, lambda ℓ: ℓ.sinks, vars(net.hypers))
+
+def record_type_key(record):
+    return type_key(
+        record['type'], record['root'], lambda ℓ: ℓ['sinks'],
+        record['hypers'])
+
+def read_profiles(path=profile_path):
+    profiles = np.load(path)[()] if exists(path) else {}
+    # Profiles written before they were keyed by network type.
+    if 'inter_op_threads' in profiles:
+        profiles = {profiles.get('net_type'): profiles}
+    return profiles
+
+def read_profile(net_type=None, path=profile_path):
+    return {**default_profile,
+            **read_profiles(path).get(net_type, {}),
+            'net_type': net_type}
+
+def write_profile(profile, path=profile_path):
+    np.save(path, {**read_profiles(path), profile['net_type']: profile})
+
+def session_config(profile=None):
+    profile = read_profile() if profile is None else profile
+    return tf.ConfigProto(
+        gpu_options=tf.GPUOptions(allow_growth=True),
+        inter_op_parallelism_threads=profile['inter_op_threads'],
+        intra_op_parallelism_threads=profile['intra_op_threads'])